@@ -27,104 +27,121 @@ tab1, tab2 = st.tabs(["📊 AQI Analysis", "🌍 Live AQI"])
 with tab1:
     file = st.file_uploader("Upload AQI CSV", type=["csv"])
 
+    data = None
     if file:
-        df = utils.load_data(file)
+        try:
+            data = utils.prepare_data(file.getvalue())
+        except ValueError as e:
+            st.error(f"⚠️ {e}")
+
+    if data:
+        df, monthly, summary = data
 
         st.subheader("Data Preview")
         st.dataframe(df.head())
 
-        st.subheader("AQI Trend Over Time")
-        trend_df = (
-            df.groupby("Date", as_index=False)["AQI"]
-            .mean()
-            .sort_values("Date")
-        )
-        st.line_chart(trend_df.set_index("Date")["AQI"])
+        st.subheader("Monthly AQI Trend by City")
+        st.line_chart(monthly)
 
-        summary = utils.summarize_data(df)
         st.subheader("AI-Powered Insights")
 
-        output_container = st.container()
-        c1, c2, c3, c4 = st.columns(4)
-
-        with c1:
-            if st.button("📈 Trend Analysis"):
-                with output_container:
-                    st.subheader("📈 Trend Analysis Result")
-                    with st.spinner("🤖 Analyzing AQI trends..."):
-                        st.write(
-                            utils.cached_gemini_response(
-                                f"""
+        # Shared preamble: the analyst role and the data come first, so the
+        # single-task prompts and the Run All batch read the same way
+        dataset_context = f"""
 You are an environmental data analyst.
 
-Analyze the AQI dataset summary below and identify:
+Dataset summary:
+{summary}
+"""
+
+        trend_task = """
+Analyze the AQI dataset summary above and identify:
 - Long-term AQI trends
 - Seasonal or recurring pollution patterns
 - Significant pollution spikes or anomalies
 
 Present findings as concise bullet points.
+"""
 
-Dataset summary:
-{summary}
+        city_task = """
+Compare average AQI levels across cities.
+Identify cleaner cities and those with consistently poor air quality.
 """
-                            )
-                        )
+
+        health_task = """
+Explain potential health impacts of observed AQI levels.
+Identify vulnerable groups and suggest general precautions.
+"""
+
+        forecast_task = """
+Based on historical AQI trends, choose one:
+- IMPROVE
+- WORSEN
+- STABLE
+
+Justify using bullet points. No numeric values.
+"""
+
+        trend_prompt = dataset_context + trend_task
+        city_prompt = dataset_context + city_task
+        health_prompt = dataset_context + health_task
+        forecast_prompt = dataset_context + forecast_task
+
+        output_container = st.container()
+        c1, c2, c3, c4, c5 = st.columns(5)
+
+        with c1:
+            if st.button("📈 Trend Analysis"):
+                with output_container:
+                    st.subheader("📈 Trend Analysis Result")
+                    with st.spinner("🤖 Analyzing AQI trends..."):
+                        utils.write_gemini_stream(trend_prompt)
 
         with c2:
             if st.button("🏙️ City Comparison"):
                 with output_container:
                     st.subheader("🏙️ City Comparison Result")
                     with st.spinner("🤖 Comparing cities..."):
-                        st.write(
-                            utils.cached_gemini_response(
-                                f"""
-Compare average AQI levels across cities.
-Identify cleaner cities and those with consistently poor air quality.
-
-Dataset summary:
-{summary}
-"""
-                            )
-                        )
+                        utils.write_gemini_stream(city_prompt)
 
         with c3:
             if st.button("🩺 Health Impact"):
                 with output_container:
                     st.subheader("🩺 Health Impact Assessment")
                     with st.spinner("🤖 Assessing health risks..."):
-                        st.write(
-                            utils.cached_gemini_response(
-                                f"""
-Explain potential health impacts of observed AQI levels.
-Identify vulnerable groups and suggest general precautions.
-
-Dataset summary:
-{summary}
-"""
-                            )
-                        )
+                        utils.write_gemini_stream(health_prompt)
 
         with c4:
             if st.button("🔮 Forecast"):
                 with output_container:
                     st.subheader("🔮 AQI Forecast Outlook")
                     with st.spinner("🤖 Generating outlook..."):
-                        st.write(
-                            utils.cached_gemini_response(
-                                f"""
-Based on historical AQI trends, choose one:
-- IMPROVE
-- WORSEN
-- STABLE
-
-Justify using bullet points. No numeric values.
+                        utils.write_gemini_stream(forecast_prompt)
 
-Dataset summary:
-{summary}
-"""
-                            )
+        with c5:
+            if st.button("⚡ Run All"):
+                with output_container:
+                    with st.spinner("🤖 Running all analyses..."):
+                        results = utils.cached_gemini_batch(
+                            {
+                                "trends": trend_task,
+                                "cities": city_task,
+                                "health": health_task,
+                                "forecast": forecast_task,
+                            },
+                            dataset_context,
                         )
 
+                    titles = [
+                        "📈 Trend Analysis Result",
+                        "🏙️ City Comparison Result",
+                        "🩺 Health Impact Assessment",
+                        "🔮 AQI Forecast Outlook",
+                    ]
+                    for title, result in zip(titles, results):
+                        st.subheader(title)
+                        st.write(result)
+
 # ==================================================
 # TAB 2: LIVE AQI (FEATURE 1 + FEATURE 2 + AUTOCOMPLETE)
 # ==================================================
@@ -1,52 +1,180 @@
+import asyncio
+import hashlib
+import io
+import json
 import pandas as pd
 import os
+import time
 import requests
 import google.genai as genai
+from google.genai import errors, types
 import streamlit as st
 
 # ===================== CSV ANALYSIS =====================
 
-def load_data(file):
-    df = pd.read_csv(file)
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%m/%d/%Y", "%d/%m/%Y"]
+
+
+def _detect_date_format(dates):
+    # Checking a small sample up front lets pandas take its fixed-format
+    # fast path instead of inferring the format for every row.
+    sample = dates.dropna().head(100).astype(str).str.strip()
+    if sample.empty:
+        return None
+
+    for fmt in DATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+            return fmt
+        except (ValueError, TypeError):
+            continue
+
+    return None
+
+
+def load_data(file_bytes: bytes):
+    # Arrow's multithreaded parser is much faster than the default engine,
+    # but it rejects ragged rows (e.g. a missing trailing field) that the
+    # default engine pads with NaN, so those files take the slower path.
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except pd.errors.ParserError:
+        df = pd.read_csv(io.BytesIO(file_bytes))
     df.columns = df.columns.str.strip()
 
     required = {"Date", "City", "AQI"}
     if not required.issubset(df.columns):
         raise ValueError("CSV must contain Date, City, AQI columns")
 
-    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-    df["AQI"] = pd.to_numeric(df["AQI"], errors="coerce")
-    df = df.dropna(subset=["Date", "AQI"])
+    dates = pd.to_datetime(
+        df["Date"],
+        format=_detect_date_format(df["Date"]),
+        errors="coerce",
+        cache=True
+    )
+    aqi = pd.to_numeric(df["AQI"], errors="coerce", downcast="float")
+    valid = dates.notna().to_numpy() & aqi.notna().to_numpy()
+    # Fail before building the frame when no row is usable
+    if not valid.any():
+        raise ValueError("CSV has no rows with both a valid Date and AQI value")
+
+    # One mask, one copy per column. Few distinct cities over many rows:
+    # categorical codes and float32 keep the working set small for the
+    # groupbys downstream. A sorted DatetimeIndex lets resampling and
+    # date slicing use binary search instead of scanning the column.
+    df = pd.DataFrame(
+        {
+            "City": pd.Categorical(df["City"].to_numpy()[valid]),
+            "AQI": aqi.to_numpy()[valid],
+        },
+        index=pd.DatetimeIndex(dates.to_numpy()[valid], name="Date"),
+    )
+    return df.sort_index(kind="stable")
+
+
+def monthly_mean(df):
+    # Month x City table of mean AQI; shared by the summary and the chart.
+    # It is handed to st.line_chart as-is on every rerun, so it is kept
+    # chart-ready: float32 values and plain string city labels, which
+    # makes the Arrow conversion small and skips categorical encoding.
+    monthly = (
+        df.groupby(["City", pd.Grouper(level="Date", freq="ME")], observed=True)["AQI"]
+        .mean()
+        .unstack("City")
+        .astype("float32")
+    )
+    monthly.columns = monthly.columns.astype(str)
+    return monthly
 
-    return df
 
+def summarize_data(df, monthly):
+    stats = df.groupby("City", sort=False, observed=True)["AQI"].agg(["mean", "min", "max"])
 
-def summarize_data(df):
-    lines = []
-    lines.append(f"Date Range: {df.Date.min().date()} to {df.Date.max().date()}")
-    lines.append(f"Cities: {', '.join(df.City.unique())}")
+    # Format every (month, city) entry in one vectorized pass, then join
+    # each city's entries instead of formatting month by month in Python.
+    monthly_values = monthly.stack().dropna()
+    if monthly_values.empty:
+        raise ValueError("CSV has no rows with both a valid Date and AQI value")
+
+    month_entries = (
+        monthly_values.index.get_level_values("Date")
+        .strftime("%Y-%m")
+        .to_series(index=monthly_values.index)
+        + ":"
+        + monthly_values.map("{:.1f}".format)
+    )
+    monthly_text = month_entries.groupby(level="City", observed=True).agg(",".join)
+
+    # Compact one-line-per-city layout: keeps the Gemini prompt small,
+    # which cuts upload size and time to first token.
+    city_lines = "\n".join(
+        f"{city},{low:.1f},{high:.1f},{mean:.1f};{monthly_text.get(str(city), '')}"
+        for city, mean, low, high in stats.itertuples()
+    )
+
+    return (
+        f"Date range: {df.index.min().date()} to {df.index.max().date()}\n"
+        "Format: city,min_aqi,max_aqi,avg_aqi;YYYY-MM:monthly_avg_aqi,...\n"
+        f"{city_lines}"
+    )
+
+
+def prepare_data(file_bytes: bytes):
+    # Every widget click reruns the script; hashing the raw upload once
+    # lets a rerun skip straight to the cached frame, chart and summary
+    # instead of re-hashing the DataFrame for each downstream step.
+    digest = hashlib.md5(file_bytes).hexdigest()
+    return _prepare_data(digest, file_bytes)
 
-    for city in df.City.unique():
-        c = df[df.City == city]
-        lines.append(
-            f"{city} → Avg AQI {c.AQI.mean():.1f}, "
-            f"Min {c.AQI.min():.1f}, Max {c.AQI.max():.1f}"
-        )
 
-    return "\n".join(lines)
+@st.cache_data(show_spinner=False)
+def _prepare_data(digest, _file_bytes):
+    df = load_data(_file_bytes)
+    monthly = monthly_mean(df)
+    return df, monthly, summarize_data(df, monthly)
 
 
 # ===================== GEMINI (SAFE + CACHED) =====================
 
-def _call_gemini(prompt: str) -> str:
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+GEMINI_MODEL = "gemini-flash-latest"
+GEMINI_CACHE_TTL = 3600
+
+
+def _gemini_api_key():
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+# One client per API key, shared across reruns and sessions so the
+# underlying HTTP connection pool stays alive between calls.
+@st.cache_resource(show_spinner=False)
+def _gemini_client(api_key: str):
+    return genai.Client(api_key=api_key)
+
+
+def _gemini_error_message(e: Exception) -> str:
+    error_text = str(e)
+
+    # ✅ Graceful handling of quota / rate-limit errors
+    if "RESOURCE_EXHAUSTED" in error_text or "429" in error_text:
+        return (
+            "⚠️ AI quota limit reached.\n\n"
+            "This feature is temporarily unavailable due to API limits.\n"
+            "The system design supports this feature and works correctly "
+            "under normal quota conditions."
+        )
+
+    return "⚠️ AI service is temporarily unavailable."
+
+
+def _call_gemini(prompt: str, model: str = GEMINI_MODEL) -> str:
+    api_key = _gemini_api_key()
     if not api_key:
         return "⚠️ Gemini API key missing."
 
     try:
-        client = genai.Client(api_key=api_key)
+        client = _gemini_client(api_key)
         response = client.models.generate_content(
-            model="gemini-flash-latest",
+            model=model,
             contents=prompt
         )
 
@@ -55,65 +183,231 @@ def _call_gemini(prompt: str) -> str:
         return "⚠️ No response generated by AI."
 
     except Exception as e:
-        error_text = str(e)
-
-        # ✅ Graceful handling of quota / rate-limit errors
-        if "RESOURCE_EXHAUSTED" in error_text or "429" in error_text:
-            return (
-                "⚠️ AI quota limit reached.\n\n"
-                "This feature is temporarily unavailable due to API limits.\n"
-                "The system design supports this feature and works correctly "
-                "under normal quota conditions."
-            )
+        return _gemini_error_message(e)
+
+
+async def _call_gemini_async(client, prompt: str, model: str) -> str:
+    response = await client.aio.models.generate_content(
+        model=model,
+        contents=prompt
+    )
+
+    if response and response.text:
+        return response.text
+    return "⚠️ No response generated by AI."
 
-        return "⚠️ AI service is temporarily unavailable."
+
+async def _gather_gemini(prompts, api_key, model):
+    client = genai.Client(api_key=api_key)
+    try:
+        results = await asyncio.gather(
+            *(_call_gemini_async(client, prompt, model) for prompt in prompts),
+            return_exceptions=True
+        )
+    finally:
+        # The async transport belongs to this asyncio.run() loop; close it
+        # before the loop shuts down instead of leaking it
+        await client.aio.aclose()
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
 
 
 # ✅ Cached wrapper (VERY IMPORTANT)
-@st.cache_data(show_spinner=False)
-def cached_gemini_response(prompt: str) -> str:
-    return _call_gemini(prompt)
+# Keyed on (prompt, model) only: the API key is read inside, never hashed.
+# The TTL lets quota errors and stale answers age out within the hour.
+@st.cache_data(show_spinner=False, ttl=GEMINI_CACHE_TTL)
+def cached_gemini_response(prompt: str, model: str = GEMINI_MODEL) -> str:
+    return _call_gemini(prompt, model)
+
+
+# ✅ Sends all prompts concurrently: one round-trip of wall time instead of N
+def cached_gemini_responses(prompts: tuple, model: str = GEMINI_MODEL) -> list:
+    if not _gemini_api_key():
+        return ["⚠️ Gemini API key missing."] * len(prompts)
+
+    try:
+        return _gemini_responses(prompts, model)
+    except Exception as e:
+        return [_gemini_error_message(e)] * len(prompts)
+
+
+# Failures raise through the cache, so they are retried on the next click
+# instead of being served for the rest of the hour
+@st.cache_data(show_spinner=False, ttl=GEMINI_CACHE_TTL)
+def _gemini_responses(prompts: tuple, model: str) -> list:
+    return list(asyncio.run(_gather_gemini(prompts, _gemini_api_key(), model)))
+
+
+def _batch_prompt(tasks: dict, context: str) -> str:
+    task_text = "\n".join(
+        f"### {name}\n{task.strip()}\n" for name, task in tasks.items()
+    )
+    return (
+        f"{context.strip()}\n\n"
+        "Complete each task below. "
+        "Return a JSON object with one markdown string field per task, "
+        "named exactly as the task heading.\n\n"
+        f"{task_text}"
+    )
+
+
+# ✅ One request for several analyses over the same data: the dataset
+# context is sent once and the answers come back as JSON fields.
+# Falls back to concurrent per-task requests if JSON mode is unusable.
+def cached_gemini_batch(tasks: dict, context: str, model: str = GEMINI_MODEL) -> list:
+    if not _gemini_api_key():
+        return ["⚠️ Gemini API key missing."] * len(tasks)
+
+    try:
+        return _gemini_batch(tasks, context, model)
+    except Exception as e:
+        return [_gemini_error_message(e)] * len(tasks)
+
+
+@st.cache_data(show_spinner=False, ttl=GEMINI_CACHE_TTL)
+def _gemini_batch(tasks: dict, context: str, model: str) -> list:
+    per_task_prompts = tuple(context + task for task in tasks.values())
+
+    try:
+        response = _gemini_client(_gemini_api_key()).models.generate_content(
+            model=model,
+            contents=_batch_prompt(tasks, context),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema={
+                    "type": "OBJECT",
+                    "properties": {name: {"type": "STRING"} for name in tasks},
+                    "required": list(tasks),
+                },
+            ),
+        )
+    except errors.ClientError as e:
+        # A 400 here means the model rejected JSON mode / the schema, which
+        # plain per-task requests avoid. Gemini also reports a bad API key
+        # as 400, and that would fail per task too. Quota, network and
+        # server errors raise through so nothing is cached.
+        if e.code != 400 or "API key" in str(e):
+            raise
+        return _gemini_responses(per_task_prompts, model)
+
+    try:
+        sections = json.loads(response.text)
+    except (json.JSONDecodeError, TypeError):
+        sections = None
+
+    if isinstance(sections, dict) and all(
+        isinstance(sections.get(name), str) and sections[name] for name in tasks
+    ):
+        return [sections[name] for name in tasks]
+
+    # Only an unusable JSON answer falls back to one request per task
+    return _gemini_responses(per_task_prompts, model)
+
+
+# Completed streamed answers for this browser session only, so they are
+# freed with the session: (prompt, model) -> (text, finished_at)
+def _streamed_responses():
+    return st.session_state.setdefault("gemini_streamed_responses", {})
+
+
+def _stream_gemini(prompt: str, model: str):
+    api_key = _gemini_api_key()
+    if not api_key:
+        yield "⚠️ Gemini API key missing."
+        return
+
+    chunks = []
+    try:
+        stream = _gemini_client(api_key).models.generate_content_stream(
+            model=model,
+            contents=prompt
+        )
+        for chunk in stream:
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+    except Exception as e:
+        yield _gemini_error_message(e)
+        return
+
+    if not chunks:
+        yield "⚠️ No response generated by AI."
+        return
+
+    # Only complete answers are kept, so failures are retried next click.
+    # Expired answers are dropped here rather than left to accumulate.
+    now = time.time()
+    responses = _streamed_responses()
+    for key in [k for k, (_, at) in responses.items() if now - at >= GEMINI_CACHE_TTL]:
+        del responses[key]
+    responses[(prompt, model)] = ("".join(chunks), now)
+
+
+# ✅ Renders the answer as it arrives: the user waits for the first
+# token instead of the whole response. Repeat prompts render from cache.
+def write_gemini_stream(prompt: str, model: str = GEMINI_MODEL) -> str:
+    cached = _streamed_responses().get((prompt, model))
+    if cached and time.time() - cached[1] < GEMINI_CACHE_TTL:
+        st.write(cached[0])
+        return cached[0]
+
+    return st.write_stream(_stream_gemini(prompt, model))
 
 
 # ===================== LIVE AQI (OPENWEATHER) =====================
 
+# Shared session: keeps OpenWeather connections alive between calls
+_SESSION = requests.Session()
+
+
+AQI_CATEGORY_MAP = {
+    1: "Good",
+    2: "Fair",
+    3: "Moderate",
+    4: "Poor",
+    5: "Very Poor"
+}
+
+
 def get_city_coordinates(city):
-    key = os.getenv("OPENWEATHER_API_KEY")
-    if not key:
+    if not os.getenv("OPENWEATHER_API_KEY"):
         return {"error": "OpenWeather API key missing"}
 
+    return _geocode_city(city.strip().lower())
+
+
+# City coordinates never change, so one lookup per city per day is enough
+@st.cache_data(show_spinner=False, ttl=86400)
+def _geocode_city(city):
+    key = os.getenv("OPENWEATHER_API_KEY")
+
     url = "https://api.openweathermap.org/geo/1.0/direct"
-    r = requests.get(
+    r = _SESSION.get(
         url,
         params={"q": city, "limit": 1, "appid": key},
         timeout=10
     )
 
-    if not r.json():
+    data = r.json()
+    if not data:
         return {"error": "City not found"}
 
     return {
-        "lat": r.json()[0]["lat"],
-        "lon": r.json()[0]["lon"]
+        "lat": data[0]["lat"],
+        "lon": data[0]["lon"]
     }
 
 
 def fetch_air_pollution(lat, lon):
-    api_key = os.getenv("OPENWEATHER_API_KEY")
-    if not api_key:
+    if not os.getenv("OPENWEATHER_API_KEY"):
         return {"error": "OpenWeather API key missing."}
 
-    url = "https://api.openweathermap.org/data/2.5/air_pollution"
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "appid": api_key
-    }
-
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = _air_pollution_data(lat, lon)
 
         if "list" not in data or not data["list"]:
             return {"error": "Air quality data unavailable from OpenWeather."}
@@ -129,6 +423,23 @@ def fetch_air_pollution(lat, lon):
         return {"error": "Failed to connect to OpenWeather service."}
 
 
+# Readings update every few minutes; failed requests raise and are not cached
+@st.cache_data(show_spinner=False, ttl=600)
+def _air_pollution_data(lat, lon):
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+
+    url = "https://api.openweathermap.org/data/2.5/air_pollution"
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "appid": api_key
+    }
+
+    response = _SESSION.get(url, params=params, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
 def fetch_live_aqi(city_name):
     location = get_city_coordinates(city_name)
     if "error" in location:
@@ -146,30 +457,16 @@ def fetch_live_aqi(city_name):
 
     aqi_value = current.get("main", {}).get("aqi")
 
-    aqi_category_map = {
-        1: "Good",
-        2: "Fair",
-        3: "Moderate",
-        4: "Poor",
-        5: "Very Poor"
-    }
-
-    category_now = aqi_category_map.get(aqi_value, "Unknown")
+    category_now = AQI_CATEGORY_MAP.get(aqi_value, "Unknown")
 
     forecast_list = pollution.get("forecast", [])
 
-    category_24h = category_now
-    category_48h = category_now
-
-    if len(forecast_list) >= 1:
-        category_24h = aqi_category_map.get(
-            forecast_list[0]["main"]["aqi"], category_now
-        )
-
-    if len(forecast_list) >= 2:
-        category_48h = aqi_category_map.get(
-            forecast_list[1]["main"]["aqi"], category_now
-        )
+    # One pass over the forecast, padded with the current category
+    forecast_categories = [
+        AQI_CATEGORY_MAP.get(f["main"]["aqi"], category_now)
+        for f in forecast_list
+    ] + [category_now, category_now]
+    category_24h, category_48h = forecast_categories[:2]
 
     forecast_text = (
         f"Next 24 Hours: {category_24h}\n"